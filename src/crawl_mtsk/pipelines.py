@@ -4,21 +4,102 @@
 # See: https://docs.scrapy.org/en/latest/topics/item-pipeline.html
 
 
+import asyncio
 import logging
+import re
 import sqlite3
+import sys
 from geopy.adapters import AioHTTPAdapter
 from geopy.geocoders import GoogleV3
 from scrapy.signals import spider_opened, spider_closed
 
 logger = logging.getLogger(__name__)
 
+# Korrekturen für Adressen, die der Geocoder sonst nicht findet
+_ADDRESS_FIXES = {
+    "berg.": "bergisch",
+    "str.": "straße",
+    "nierosta": "nirosta",
+    "linz-kretzhaus": "vettelschoß",
+    "wuelfrath": "velbert",
+    "saaner": "saarner",
+    "-thomasberg": "",
+}
+_ADDRESS_FIXES_RE = re.compile(
+    "|".join(re.escape(k) for k in sorted(_ADDRESS_FIXES, key=len, reverse=True))
+)
+
+_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-20000",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA foreign_keys=ON",
+)
+
+# Statements are kept as module constants so sqlite3's statement cache
+# reuses the prepared statement for every item.
+_SQL_SELECT_STATIONS = """
+    SELECT station_id, id FROM gas_stations
+"""
+
+_SQL_SELECT_GEOCODED = """
+    SELECT station_id FROM gas_stations
+    WHERE latitude IS NOT NULL
+"""
+
+_SQL_UPSERT_STATION = """
+    INSERT INTO gas_stations (station_id, name, address, latitude, longitude)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(station_id) DO UPDATE SET
+        latitude = COALESCE(excluded.latitude, latitude),
+        longitude = COALESCE(excluded.longitude, longitude)
+    RETURNING id
+"""
+
+_SQL_UPDATE_COORDS = """
+    UPDATE gas_stations
+    SET latitude = ?, longitude = ?
+    WHERE id = ?
+"""
+
+_SQL_SELECT_GEOCODE_CACHE = """
+    SELECT address, latitude, longitude, resolved_address FROM geocode_cache
+"""
+
+_SQL_INSERT_GEOCODE_CACHE = """
+    INSERT OR IGNORE INTO geocode_cache
+    (address, latitude, longitude, resolved_address)
+    VALUES (?, ?, ?, ?)
+"""
+
+_SQL_INSERT_PRICE = """
+    INSERT INTO price_history
+    (station_id, price_diesel, price_super, price_super_e10, last_transmission)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(station_id, last_transmission) DO NOTHING
+"""
+
 
 class DBClient:
     logger = logging.getLogger(__name__)
 
-    def __init__(self, db_path: str):
-        self.connection = sqlite3.connect(db_path)
+    def __init__(self, db_path: str, batch_size: int = 500):
+        # IMMEDIATE takes the write lock at transaction start, so a second
+        # connection on the same file waits (busy_timeout) instead of failing
+        # with SQLITE_BUSY when upgrading a read to a write lock.
+        self.connection = sqlite3.connect(
+            db_path, isolation_level="IMMEDIATE", cached_statements=512
+        )
+        for pragma in _PRAGMAS:
+            self.connection.execute(pragma)
         self.station_cache = {}
+        self.geocoded_ids: set[str] = set()
+        self.batch_size = batch_size
+        self._price_buffer: list[tuple] = []
+        self._coordinate_buffer: list[tuple] = []
+        self._geocode_buffer: list[tuple] = []
 
     def create_schema(self):
         with self.connection:
@@ -45,81 +126,121 @@ class DBClient:
                 UNIQUE(station_id, last_transmission)
             )""")
 
+            self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS geocode_cache (
+                address TEXT PRIMARY KEY,
+                latitude REAL NOT NULL,
+                longitude REAL NOT NULL,
+                resolved_address TEXT
+            )""")
+
     def save_item(self, item):
-        self._create_cache()
-        with self.connection:
-            # Stammdaten einfügen/aktualisieren
-            self._create_station(item)
+        db_id = self.station_cache.get(item["id"])
+        if db_id is None:
+            with self.connection:
+                # Stammdaten samt Koordinaten einfügen
+                self._create_station(item)
+        else:
+            item["db_id"] = db_id
             self._update_coordinates(item)
+        if item.get("last_transmission") is None:
+            # Would violate NOT NULL and abort the whole batch on flush()
+            logger.warning(
+                "No transmission time for station %s, prices not saved", item["id"]
+            )
+        else:
             self._save_prices(item)
-            return item
+        # batch_size 0 keeps everything in memory until close()
+        if self.batch_size and len(self._price_buffer) >= self.batch_size:
+            self.flush()
+        return item
+
+    def flush(self):
+        """Write all buffered rows in a single transaction."""
+        buffers = (self._price_buffer, self._coordinate_buffer, self._geocode_buffer)
+        if not any(buffers):
+            return
+        logger.debug(
+            "Flushing %d price rows, %d coordinates and %d geocoding results",
+            *map(len, buffers),
+        )
+        with self.connection:
+            self.connection.executemany(_SQL_UPDATE_COORDS, self._coordinate_buffer)
+            # Duplicates (same station and transmission) must not abort the batch
+            self.connection.executemany(_SQL_INSERT_PRICE, self._price_buffer)
+            self.connection.executemany(_SQL_INSERT_GEOCODE_CACHE, self._geocode_buffer)
+        for buffer in buffers:
+            buffer.clear()
+
+    def load_geocoded_ids(self):
+        """Load the ids of all stations that already have coordinates."""
+        cursor = self.connection.execute(_SQL_SELECT_GEOCODED)
+        self.geocoded_ids = {sys.intern(row[0]) for row in cursor}
+        logger.info("Loaded %d geocoded stations", len(self.geocoded_ids))
 
     def is_geocoded(self, item):
-        query = """
-            select latitude from gas_stations
-            where station_id = ?
-            """
-        result = self.connection.execute(query, (item["id"],)).fetchone()
-        logger.debug("Checking geocoding need for %s: %s", item["id"], result)
-        return result is not None and result[0] is not None
+        return item["id"] in self.geocoded_ids
+
+    def load_geocode_cache(self):
+        """Return all cached geocoding results keyed by normalized address."""
+        cursor = self.connection.execute(_SQL_SELECT_GEOCODE_CACHE)
+        return {address: tuple(location) for address, *location in cursor}
+
+    def save_geocode(self, address, latitude, longitude, resolved_address):
+        # Buffered like the prices; flushing at batch_size bounds what a crash
+        # can lose at the cost of one synchronous write per batch.
+        self._geocode_buffer.append((address, latitude, longitude, resolved_address))
+        if self.batch_size and len(self._geocode_buffer) >= self.batch_size:
+            self.flush()
 
     def _create_station(self, item):
-        if item["id"] not in self.station_cache:
-            result = self.connection.execute(
-                """
-                INSERT INTO gas_stations (station_id, name, address, latitude, longitude)
-                VALUES (?, ?, ?, ?, ?)
-                RETURNING id
-                """,
-                (
-                    item["id"],
-                    item["name"],
-                    item["address"],
-                    item.get("latitude"),
-                    item.get("longitude"),
-                ),
-            ).fetchone()
-            db_id = result[0]
-            self.station_cache[item["id"]] = db_id
-        item["db_id"] = self.station_cache[item["id"]]
+        (db_id,) = self.connection.execute(
+            _SQL_UPSERT_STATION,
+            (
+                item["id"],
+                item["name"],
+                item["address"],
+                item.get("latitude"),
+                item.get("longitude"),
+            ),
+        ).fetchone()
+        self.station_cache[item["id"]] = db_id
+        item["db_id"] = db_id
+        if item.get("latitude") is not None:
+            self.geocoded_ids.add(item["id"])
 
     def _update_coordinates(self, item):
+        if item["id"] in self.geocoded_ids:
+            # Coordinates are already stored, rewriting them is wasted work
+            return
         if item.get("latitude") is not None:
-            self.connection.execute(
-                """
-                UPDATE gas_stations
-                SET latitude = ?, longitude = ?
-                WHERE id = ?
-                """,
-                (item["latitude"], item["longitude"], item["db_id"]),
+            self._coordinate_buffer.append(
+                (item["latitude"], item["longitude"], item["db_id"])
             )
+            self.geocoded_ids.add(item["id"])
 
     def _save_prices(self, item):
-        self.connection.execute(
-            """
-                INSERT INTO price_history 
-                (station_id, price_diesel, price_super, price_super_e10, last_transmission)
-                VALUES (?, ?, ?, ?, ?)
-            """,
+        self._price_buffer.append(
             (
                 item["db_id"],
                 item.get("price_diesel"),
                 item.get("price_super"),
                 item.get("price_super_e10"),
-                item.get("last_transmission"),
-            ),
+                item["last_transmission"],
+            )
         )
 
-    def _create_cache(self):
-        if self.station_cache:
-            return
+    def load_station_cache(self):
+        """Load the mapping of station ids to database ids."""
         logger.info("Creating station cache")
-        station_ids = self.connection.execute("""
-            SELECT station_id, id FROM gas_stations
-        """).fetchall()
-        self.station_cache = {station_id: id for station_id, id in station_ids}
+        # Interned keys match the interned ids from the spiders by identity
+        self.station_cache = {
+            sys.intern(station_id): db_id
+            for station_id, db_id in self.connection.execute(_SQL_SELECT_STATIONS)
+        }
 
     def close(self):
+        self.flush()
         self.connection.commit()
         self.connection.close()
 
@@ -131,11 +252,14 @@ class SQLitePipeline:
     @classmethod
     def from_crawler(cls, crawler):
         db_path = crawler.settings.get("SQLITE_DB_PATH")
-        client = DBClient(db_path)
+        batch_size = crawler.settings.getint("SQLITE_BATCH_SIZE", 500)
+        client = DBClient(db_path, batch_size=batch_size)
         return cls(client=client)
 
     def open_spider(self):
         self.client.create_schema()
+        self.client.load_station_cache()
+        self.client.load_geocoded_ids()
 
     def close_spider(self):
         self.client.close()
@@ -145,17 +269,25 @@ class SQLitePipeline:
 
 
 class GeoCodingPipeline:
-    def __init__(self, db_client: DBClient, api_key: str):
+    def __init__(self, db_client: DBClient, api_key: str, concurrency: int = 5):
         self.db_client = db_client
         self.api_key = api_key
+        self.concurrency = concurrency
+        self.geocode_cache = {}
+        self._pending: dict[str, asyncio.Future] = {}
 
     async def open_spider(self):
         self.db_client.create_schema()
+        self.db_client.load_geocoded_ids()
+        self.geocode_cache = self.db_client.load_geocode_cache()
+        self._semaphore = asyncio.Semaphore(self.concurrency)
         self.locator = GoogleV3(
             api_key=self.api_key,
             user_agent="crawl-mtsk",
             adapter_factory=AioHTTPAdapter,
         )
+        # Entering the context keeps one aiohttp session, so all geocode calls
+        # reuse pooled keep-alive connections instead of a handshake each.
         await self.locator.__aenter__()
 
     async def close_spider(self):
@@ -164,23 +296,31 @@ class GeoCodingPipeline:
 
     @classmethod
     def from_crawler(cls, crawler):
-        client = DBClient(db_path=crawler.settings.get("SQLITE_DB_PATH"))
+        db_path = crawler.settings.get("SQLITE_DB_PATH")
+        batch_size = crawler.settings.getint("SQLITE_BATCH_SIZE", 500)
+        client = DBClient(db_path, batch_size=batch_size)
         api_key = crawler.settings.get("GOOGLE_MAPS_API_KEY")
-        pipeline = cls(client, api_key)
+        concurrency = crawler.settings.getint("GEOCODE_CONCURRENCY", 5)
+        pipeline = cls(client, api_key, concurrency)
         return pipeline
 
     async def process_item(self, item):
         if self.db_client.is_geocoded(item):
             logger.debug("Item %s already geocoded, skipping", item["id"])
             return item
-        logger.info("Geocoding address for %s", item["address"])
         address = self.fix_adresses(item["address"])
-        location = await self.locator.geocode(address, exactly_one=True)
+        location = self.geocode_cache.get(address)
+        if location is None:
+            location = await self._geocode(address)
+            # Stored by the first item to resume, outside the shared future, so
+            # a failing write cannot fail every item waiting on the request
+            if location and address not in self.geocode_cache:
+                self.geocode_cache[address] = location
+                self._save_geocode(address, location)
         if location:
             logger.info("Found coordinates for %s: %s", item["id"], location)
-            item["latitude"] = location.latitude
-            item["longitude"] = location.longitude
-            item["address"] = location.address
+            item["latitude"], item["longitude"], item["address"] = location
+            self.db_client.geocoded_ids.add(item["id"])
         else:
             logger.warning(
                 "Could not find coordinates for %s: %s", item["id"], item["address"]
@@ -189,14 +329,30 @@ class GeoCodingPipeline:
             item["longitude"] = None
         return item
 
+    async def _geocode(self, address):
+        # Items with the same address share a single in-flight request
+        pending = self._pending.get(address)
+        if pending is None:
+            pending = asyncio.ensure_future(self._geocode_one(address))
+            self._pending[address] = pending
+            pending.add_done_callback(lambda _: self._pending.pop(address, None))
+        return await pending
+
+    async def _geocode_one(self, address):
+        async with self._semaphore:
+            logger.info("Geocoding address %s", address)
+            location = await self.locator.geocode(address, exactly_one=True)
+        if not location:
+            return None
+        return location.latitude, location.longitude, location.address
+
+    def _save_geocode(self, address, location):
+        try:
+            self.db_client.save_geocode(address, *location)
+        except sqlite3.Error:
+            logger.exception("Could not store geocoding result for %s", address)
+
     def fix_adresses(self, address):
-        return (
-            address.lower()
-            .replace("berg.", "bergisch")
-            .replace("str.", "straße")
-            .replace("nierosta", "nirosta")
-            .replace("linz-kretzhaus", "vettelschoß")
-            .replace("wuelfrath", "velbert")
-            .replace("saaner", "saarner")
-            .replace("-thomasberg", "")
+        return _ADDRESS_FIXES_RE.sub(
+            lambda match: _ADDRESS_FIXES[match.group(0)], address.lower()
         )
@@ -28,8 +28,9 @@ USER_AGENT = (
 ROBOTSTXT_OBEY = False
 
 # Concurrency and throttling settings
-# CONCURRENT_REQUESTS = 16
-# CONCURRENT_REQUESTS_PER_DOMAIN = 8
+CONCURRENT_REQUESTS = 16
+# Each spider crawls a single domain, so it may use the whole request budget
+CONCURRENT_REQUESTS_PER_DOMAIN = 16
 DOWNLOAD_DELAY = 0
 
 # Disable cookies (enabled by default)
@@ -59,8 +60,12 @@ ITEM_PIPELINES = {
 
 # SQLite Datenbank Einstellungen
 SQLITE_DB_PATH = "tankstellen.db"
+# Preise pro Transaktion; 0 schreibt alles in einer Transaktion beim Beenden
+SQLITE_BATCH_SIZE = 500
 
 GOOGLE_MAPS_API_KEY = os.getenv("GOOGLE_MAPS_API_KEY")
+# Maximale Anzahl paralleler Geocoding-Anfragen
+GEOCODE_CONCURRENCY = 5
 
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
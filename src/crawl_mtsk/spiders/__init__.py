@@ -3,3 +3,44 @@
 # Please refer to the documentation for information on how to create and manage
 # your spiders.
 
+import re
+
+from lxml import etree
+
+_PRICE_RE = re.compile(r"(\d+)\.(\d{2,3})")
+
+
+def compile_xpath(expression):
+    """Compile ``expression`` once for all responses of a spider.
+
+    smart_strings=False returns plain str results that do not keep the parsed
+    page alive through getparent().
+    """
+    return etree.XPath(expression, smart_strings=False)
+
+
+def has_class(name):
+    """XPath predicate matching ``name`` as one of the element's class tokens."""
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+def price_row_xpath(label, price):
+    """Compile an XPath that reads one price row as ``label|price``.
+
+    Whitespace between the price and its superscript digit is dropped in
+    libxml2, so each row costs a single call.
+    """
+    return compile_xpath(
+        f"concat(string({label}), '|', "
+        f"translate(normalize-space({price}), ' ', ''))"
+    )
+
+
+def parse_price(text):
+    """Parse a price like ``1.559`` (shown as ``1.55<sup>9</sup>``) into euros."""
+    match = _PRICE_RE.search(text)
+    if not match:
+        return None
+    # Integer milli-euros, divided once, instead of float() on the string
+    euros, milli = match.groups()
+    return (int(euros) * 1000 + int(milli.ljust(3, "0"))) / 1000
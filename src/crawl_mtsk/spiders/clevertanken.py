@@ -1,9 +1,44 @@
 from datetime import datetime
 import os
+import sys
 from typing import Any
 import scrapy
+from parsel import css2xpath
 
 from crawl_mtsk.items import GasStationItem
+from crawl_mtsk.spiders import compile_xpath, has_class, parse_price, price_row_xpath
+
+_NEXT_PAGE_XPATH = compile_xpath(css2xpath("a.right-arrow.ml-2::attr(href)"))
+_NAME_XPATH = compile_xpath(css2xpath("span.strong-title::text"))
+_ADDRESS_XPATH = compile_xpath(
+    f"normalize-space(//div[{has_class('location-address')}])"
+)
+_PRICE_ROWS_XPATH = compile_xpath(
+    f"//div[@id='prices-container']/div[{has_class('price-row')}]"
+)
+_ROW_XPATH = price_row_xpath(
+    f".//div[{has_class('price-type-name')}]", f".//div[{has_class('price-field')}]"
+)
+_TRANSMISSION_XPATH = compile_xpath(
+    f"normalize-space(substring-after(//div[{has_class('price-footer')}]/span, ':'))"
+)
+
+_PRICE_FIELDS = {
+    "Diesel": "price_diesel",
+    "Super E5": "price_super",
+    "Super E10": "price_super_e10",
+}
+
+
+def _parse_transmission(text):
+    """Parse ``dd.mm.yyyy HH:MM`` from fixed positions instead of strptime."""
+    return datetime(
+        int(text[6:10]),
+        int(text[3:5]),
+        int(text[0:2]),
+        int(text[11:13]),
+        int(text[14:16]),
+    )
 
 
 class CleverTankenSpider(scrapy.Spider):
@@ -18,6 +53,7 @@ class CleverTankenSpider(scrapy.Spider):
         longitude: str | float,
         name: str | None = None,
         radius: str | int = 1,
+        fuels: str = "3,5,7",
         **kwargs: Any,
     ):
         super().__init__(name, **kwargs)
@@ -29,9 +65,12 @@ class CleverTankenSpider(scrapy.Spider):
         self.latitude = float(latitude)
         self.longitude = float(longitude)
         self.radius = int(radius)
+        # Every detail page carries all prices, but each fuel list also finds
+        # stations that only sell that fuel
+        self.fuels = [int(fuel) for fuel in str(fuels).split(",")]
 
     async def start(self):
-        for fuel in (3, 5, 7):
+        for fuel in self.fuels:
             yield scrapy.Request(
                 self.url_template.format(
                     fuel=fuel,
@@ -44,43 +83,37 @@ class CleverTankenSpider(scrapy.Spider):
             )
 
     def parse(self, response):
-        yield from response.follow_all(
-            response.xpath("//div[@id='main-column-container']/a/@href"),
-            self.parse_station,
-        )
+        root = response.selector.root
+        container = root.find(".//div[@id='main-column-container']")
+        if container is not None:
+            for link in container.iterfind("a"):
+                href = link.get("href")
+                if href:
+                    yield response.follow(href, self.parse_station)
 
-        next_page = response.css("a.right-arrow.ml-2::attr(href)")
+        next_page = _NEXT_PAGE_XPATH(root)
         if next_page:
-            yield response.follow(next_page.get(), self.parse)
+            yield response.follow(next_page[0], self.parse)
 
     def parse_station(self, response):
+        root = response.selector.root
         item = GasStationItem()
-        item["id"] = response.url.split("/")[-1]
-        item["name"] = response.css("span.strong-title::text").get()
-        address_parts = response.css("div.location-address span::text").getall()
-        item["address"] = " ".join(part.strip() for part in address_parts)
+        item["id"] = sys.intern(response.url.rpartition("/")[2])
+        names = _NAME_XPATH(root)
+        item["name"] = names[0] if names else None
+        item["address"] = _ADDRESS_XPATH(root)
 
-        labels = response.css("div.price-type-name::text").getall()
-        prices = response.css("div.price-field")
-        for label, price in zip(labels, prices, strict=False):
-            price = "".join(_.strip() for _ in price.xpath(".//text()").getall())
-            try:
-                price = float(price)
-            except ValueError:
-                price = None
-            match label:
-                case "Diesel":
-                    item["price_diesel"] = price
-                case "Super E5":
-                    item["price_super"] = price
-                case "Super E10":
-                    item["price_super_e10"] = price
+        for row in _PRICE_ROWS_XPATH(root):
+            label, _, price = _ROW_XPATH(row).rpartition("|")
+            field = _PRICE_FIELDS.get(label)
+            if field is not None:
+                item[field] = parse_price(price)
+        if all(item.get(field) is None for field in _PRICE_FIELDS.values()):
+            # Stale listing: nothing worth storing, skip the timestamp as well
+            self.logger.debug("No prices for station %s", item["id"])
+            return
 
-        transmission_date = (
-            response.css("div.price-footer span::text").get().split(":", 1)[1].strip()
-        )
+        transmission_date = _TRANSMISSION_XPATH(root)
         if transmission_date:
-            item["last_transmission"] = datetime.strptime(
-                transmission_date, "%d.%m.%Y %H:%M"
-            )
+            item["last_transmission"] = _parse_transmission(transmission_date)
         yield item
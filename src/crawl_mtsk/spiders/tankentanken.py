@@ -1,9 +1,39 @@
 import ast
 import os
+import sys
 from datetime import datetime
 import scrapy
 
 from crawl_mtsk.items import GasStationItem
+from crawl_mtsk.spiders import compile_xpath, has_class, parse_price, price_row_xpath
+
+_STATION_HREFS_XPATH = compile_xpath(f"//a[{has_class('station-item')}]/@href")
+_NAME_XPATH = compile_xpath(
+    f"//div[{has_class('headline')} and {has_class('uppercase')}]//*/text()"
+)
+_ADDRESS_XPATH = compile_xpath(
+    f"//div[{has_class('article')}]/h3/following-sibling::p/text()"
+)
+_PRICE_ROWS_XPATH = compile_xpath(f"//div[{has_class('price-list')}]/div")
+_ROW_XPATH = price_row_xpath(f"div[{has_class('label')}]", f"div[{has_class('price')}]")
+_TIMESTAMP_XPATH = compile_xpath(f"//span[{has_class('time-of-capture')}]/text()")
+
+_PRICE_FIELDS = {
+    "Diesel:": "price_diesel",
+    "Super:": "price_super",
+    "Super E10:": "price_super_e10",
+}
+
+
+def _parse_transmission(text):
+    """Parse ``dd.mm.yyyy / HH:MM`` from fixed positions instead of strptime."""
+    return datetime(
+        int(text[6:10]),
+        int(text[3:5]),
+        int(text[0:2]),
+        int(text[13:15]),
+        int(text[16:18]),
+    )
 
 
 class TankenTankenSpider(scrapy.Spider):
@@ -75,7 +105,7 @@ class TankenTankenSpider(scrapy.Spider):
         @returns request 1 1
         """
         yield from response.follow_all(
-            xpath='//a[@class="station-item"]/@href', callback=self.parse_station
+            _STATION_HREFS_XPATH(response.selector.root), callback=self.parse_station
         )
 
     def parse_station(self, response):
@@ -84,42 +114,26 @@ class TankenTankenSpider(scrapy.Spider):
         @returns items 1 1
         @scrapes id name address price_diesel price_super price_super_e10 last_transmission
         """
+        root = response.selector.root
         item = GasStationItem()
-        item["id"] = response.url.split("/")[-1]
+        item["id"] = sys.intern(response.url.rpartition("/")[2])
 
-        item["name"] = (
-            "".join(_ for _ in response.css("div.headline.uppercase *::text").getall())
-            .split("|")[0]
-            .strip()
-        )
+        item["name"] = "".join(_NAME_XPATH(root)).split("|")[0].strip()
 
-        item["address"] = ", ".join(
-            _.strip()
-            for _ in response.xpath(
-                "//div[@class='article']/h3//following-sibling::p/text()"
-            ).getall()
-        )
+        item["address"] = ", ".join(_.strip() for _ in _ADDRESS_XPATH(root))
+
+        for row in _PRICE_ROWS_XPATH(root):
+            label, _, price = _ROW_XPATH(row).rpartition("|")
+            field = _PRICE_FIELDS.get(label)
+            if field is not None:
+                item[field] = parse_price(price)
+        if all(item.get(field) is None for field in _PRICE_FIELDS.values()):
+            # Stale listing: nothing worth storing, skip the timestamp as well
+            self.logger.debug("No prices for station %s", item["id"])
+            return
 
-        labels = response.css("div.label::text").getall()
-        prices = response.css("div.price")
-        for label, price in zip(labels, prices, strict=False):
-            price = "".join(_.strip() for _ in price.xpath(".//text()").getall())
-            try:
-                price = float(price)
-            except ValueError:
-                price = None
-            match label:
-                case "Diesel:":
-                    item["price_diesel"] = price
-                case "Super:":
-                    item["price_super"] = price
-                case "Super E10:":
-                    item["price_super_e10"] = price
-
-        timestamp_str = response.xpath("//span[@class='time-of-capture']/text()").get()
-        if timestamp_str:
-            item["last_transmission"] = datetime.strptime(
-                timestamp_str.strip(), "%d.%m.%Y / %H:%M"
-            )
+        timestamps = _TIMESTAMP_XPATH(root)
+        if timestamps:
+            item["last_transmission"] = _parse_transmission(timestamps[0].strip())
 
         yield item
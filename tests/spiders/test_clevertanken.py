@@ -30,6 +30,25 @@ def station_detail():
         )
 
 
+@pytest.mark.asyncio
+async def test_start():
+    spider = CleverTankenSpider("adresse", "50.0", "8.0")
+
+    requests = [_ async for _ in spider.start()]
+
+    assert [r.url.split("spritsorte=")[1][0] for r in requests] == ["3", "5", "7"]
+
+
+@pytest.mark.asyncio
+async def test_start_with_fuels():
+    spider = CleverTankenSpider("adresse", "50.0", "8.0", fuels="5")
+
+    requests = [_ async for _ in spider.start()]
+
+    assert len(requests) == 1
+    assert "spritsorte=5" in requests[0].url
+
+
 def test_spider_parse(station_list):
     spider = CleverTankenSpider("adresse", "50.0", "8.0")
 
@@ -61,3 +80,33 @@ def test_spider_parse_station(station_detail):
     assert item["price_super"] == 1.649
     assert item["price_super_e10"] == 1.589
     assert item["last_transmission"] == datetime.fromisoformat("2025-08-13 16:23")
+
+
+def test_spider_parse_station_without_prices():
+    response = TextResponse(
+        url="https://www.clever-tanken.de/tankstelle_details/1",
+        body=b"<html><body><span class='strong-title'>Closed</span></body></html>",
+        encoding="utf-8",
+        request=Request(url="https://www.clever-tanken.de/tankstelle_details/1"),
+    )
+    spider = CleverTankenSpider("adresse", "50.0", "8.0")
+
+    assert list(spider.parse_station(response)) == []
+
+
+def test_spider_parse_station_with_empty_prices():
+    rows = "".join(
+        "<div class='price-row'><div class='price-type-name'>"
+        f"{label}</div><div class='price-field'>-</div></div>"
+        for label in ("Diesel", "Super E5")
+    )
+    response = TextResponse(
+        url="https://www.clever-tanken.de/tankstelle_details/1",
+        body=f"<html><body><div id='prices-container'>{rows}</div></body></html>",
+        encoding="utf-8",
+        request=Request(url="https://www.clever-tanken.de/tankstelle_details/1"),
+    )
+    spider = CleverTankenSpider("adresse", "50.0", "8.0")
+
+    # Labels without a price must not yield an all-NULL price row
+    assert list(spider.parse_station(response)) == []
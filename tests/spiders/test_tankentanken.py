@@ -1,3 +1,4 @@
+from datetime import datetime
 import pytest
 from scrapy.http import TextResponse, Request
 from crawl_mtsk.spiders.tankentanken import TankenTankenSpider
@@ -84,4 +85,5 @@ def test_parse_station_details(station_detail):
     assert item["price_diesel"] == 1.509
     assert item["price_super_e10"] == 1.579
     assert item["price_super"] == 1.639
+    assert item["last_transmission"] == datetime(2025, 8, 7, 13, 40)
     assert "address" in item
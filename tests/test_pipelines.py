@@ -1,6 +1,10 @@
+import asyncio
+import sqlite3
+from types import SimpleNamespace
+
 import pytest
 
-from crawl_mtsk.pipelines import DBClient
+from crawl_mtsk.pipelines import DBClient, GeoCodingPipeline
 
 
 @pytest.fixture
@@ -24,6 +28,7 @@ def test_save_item(db_client):
         "last_transmission": "2023-10-01T12:00:00Z",
     }
     db_client.save_item(item)
+    db_client.flush()
 
     # Verify the item was saved correctly
     result = db_client.connection.execute(
@@ -81,6 +86,7 @@ def test_save_item_second_time_works(db_client):
     db_client.save_item(item)
     item["last_transmission"] = "2023-10-01T12:01:00Z"
     db_client.save_item(item)
+    db_client.flush()
 
     result = db_client.connection.execute(
         "select count(*) from gas_stations"
@@ -93,6 +99,128 @@ def test_save_item_second_time_works(db_client):
     assert result[0] == 2
 
 
+def test_save_item_adds_coordinates_to_existing_station(db_client, tmp_path):
+    item = {
+        "id": "test_station",
+        "name": "Test Station",
+        "address": "123 Test St, Test City",
+        "last_transmission": "2023-10-01T12:00:00Z",
+    }
+    db_client.save_item(item)
+    db_client.flush()
+
+    # A client without the station in its cache must not insert a duplicate
+    other_client = DBClient(tmp_path / "test_db.sqlite")
+    other_client.save_item(
+        {**item, "latitude": 50.0, "longitude": 8.0, "last_transmission": "later"}
+    )
+    other_client.close()
+
+    result = db_client.connection.execute(
+        "select id, latitude, longitude from gas_stations"
+    ).fetchall()
+    assert result == [(item["db_id"], 50.0, 8.0)]
+
+
+def test_save_item_keeps_stored_coordinates(db_client):
+    item = {
+        "id": "test_station",
+        "name": "Test Station",
+        "address": "123 Test St, Test City",
+        "latitude": 50.0,
+        "longitude": 8.0,
+        "last_transmission": "2023-10-01T12:00:00Z",
+    }
+    db_client.save_item(item)
+    db_client.save_item(
+        {**item, "latitude": 51.0, "longitude": 9.0, "last_transmission": "later"}
+    )
+    db_client.flush()
+
+    result = db_client.connection.execute(
+        "select latitude, longitude from gas_stations"
+    ).fetchall()
+    assert result == [(50.0, 8.0)]
+
+
+def test_prices_are_buffered_until_batch_size(tmp_path):
+    client = DBClient(tmp_path / "test_db.sqlite", batch_size=2)
+    client.create_schema()
+    item = {
+        "id": "test_station",
+        "name": "Test Station",
+        "address": "123 Test St, Test City",
+        "price_diesel": 1.5,
+        "last_transmission": "2023-10-01T12:00:00Z",
+    }
+    client.save_item(item)
+
+    count = "select count(*) from price_history"
+    assert client.connection.execute(count).fetchone()[0] == 0
+
+    # Same transmission again is ignored instead of failing the whole batch
+    client.save_item(item)
+    assert client.connection.execute(count).fetchone()[0] == 1
+
+    client.close()
+
+
+def test_batch_size_zero_writes_prices_on_close(tmp_path):
+    client = DBClient(tmp_path / "test_db.sqlite", batch_size=0)
+    client.create_schema()
+    for minute in range(3):
+        client.save_item(
+            {
+                "id": "test_station",
+                "name": "Test Station",
+                "address": "123 Test St, Test City",
+                "last_transmission": f"2023-10-01T12:0{minute}:00Z",
+            }
+        )
+    count = "select count(*) from price_history"
+    assert client.connection.execute(count).fetchone()[0] == 0
+    client.close()
+
+    other_client = DBClient(tmp_path / "test_db.sqlite")
+    assert other_client.connection.execute(count).fetchone()[0] == 3
+    other_client.close()
+
+
+def test_item_without_transmission_keeps_batch(db_client):
+    station = {"name": "Test Station", "address": "123 Test St, Test City"}
+    db_client.save_item({"id": "no_footer", **station, "price_diesel": 1.5})
+    db_client.save_item(
+        {
+            "id": "test_station",
+            **station,
+            "price_diesel": 1.6,
+            "last_transmission": "2023-10-01T12:00:00Z",
+        }
+    )
+    db_client.flush()
+
+    rows = db_client.connection.execute(
+        "select price_diesel from price_history"
+    ).fetchall()
+    assert rows == [(1.6,)]
+
+
+def test_load_station_cache(db_client, tmp_path):
+    item = {
+        "id": "test_station",
+        "name": "Test Station",
+        "address": "123 Test St, Test City",
+        "last_transmission": "2023-10-01T12:00:00Z",
+    }
+    db_client.save_item(item)
+
+    other_client = DBClient(tmp_path / "test_db.sqlite")
+    other_client.load_station_cache()
+
+    assert other_client.station_cache == {"test_station": item["db_id"]}
+    other_client.close()
+
+
 def test_is_geocoded(db_client):
     item = {
         "id": "test_station",
@@ -111,3 +239,118 @@ def test_is_geocoded(db_client):
         "id": "test_station_no_coords",
     }
     assert db_client.is_geocoded(item_no_coords) is False
+
+
+def test_load_geocoded_ids(db_client, tmp_path):
+    db_client.save_item(
+        {
+            "id": "test_station",
+            "name": "Test Station",
+            "address": "123 Test St, Test City",
+            "latitude": 50.0,
+            "longitude": 8.0,
+            "last_transmission": "2023-10-01T12:00:00Z",
+        }
+    )
+    db_client.save_item(
+        {
+            "id": "test_station_no_coords",
+            "name": "Other Station",
+            "address": "456 Test St, Test City",
+            "last_transmission": "2023-10-01T12:00:00Z",
+        }
+    )
+
+    other_client = DBClient(tmp_path / "test_db.sqlite")
+    other_client.load_geocoded_ids()
+
+    assert other_client.geocoded_ids == {"test_station"}
+    other_client.close()
+
+
+def test_geocode_cache_roundtrip(db_client):
+    db_client.save_geocode(
+        "bonner straße 417 köln", 50.9, 6.96, "Bonner Str. 417, 50968 Köln"
+    )
+    # A second result for the same address keeps the first one
+    db_client.save_geocode("bonner straße 417 köln", 0.0, 0.0, None)
+    db_client.flush()
+
+    assert db_client.load_geocode_cache() == {
+        "bonner straße 417 köln": (50.9, 6.96, "Bonner Str. 417, 50968 Köln")
+    }
+
+
+def test_geocode_results_are_flushed_at_batch_size(tmp_path):
+    client = DBClient(tmp_path / "test_db.sqlite", batch_size=2)
+    client.create_schema()
+    client.save_geocode("a", 50.0, 7.0, None)
+
+    count = "select count(*) from geocode_cache"
+    assert client.connection.execute(count).fetchone()[0] == 0
+
+    client.save_geocode("b", 51.0, 7.0, None)
+    assert client.connection.execute(count).fetchone()[0] == 2
+
+    client.close()
+
+
+class FakeLocator:
+    def __init__(self):
+        self.calls = []
+
+    async def geocode(self, address, exactly_one=True):
+        self.calls.append(address)
+        # Let the other items reach the pipeline while this call is in flight
+        await asyncio.sleep(0)
+        return SimpleNamespace(latitude=50.9, longitude=6.96, address=address)
+
+
+@pytest.mark.asyncio
+async def test_geocoding_deduplicates_addresses(db_client):
+    pipeline = GeoCodingPipeline(db_client, api_key=None, concurrency=2)
+    pipeline._semaphore = asyncio.Semaphore(pipeline.concurrency)
+    pipeline.locator = FakeLocator()
+    cached = pipeline.fix_adresses("Hauptstr. 1, Köln")
+    pipeline.geocode_cache[cached] = (50.0, 7.0, "Hauptstr. 1, 50667 Köln")
+
+    items = [
+        {"id": "a", "address": "Bonner Str. 417, Köln"},
+        {"id": "b", "address": "Bonner Str. 417, Köln"},
+        {"id": "c", "address": "Hauptstr. 1, Köln"},
+    ]
+    await asyncio.gather(*(pipeline.process_item(item) for item in items))
+
+    # One call for both items with the same address, none for the cached one
+    assert pipeline.locator.calls == [pipeline.fix_adresses(items[0]["address"])]
+    assert pipeline._pending == {}
+    assert items[1]["latitude"] == 50.9
+    assert items[2]["latitude"] == 50.0
+
+
+@pytest.mark.asyncio
+async def test_geocoding_survives_failing_cache_write(db_client):
+    def save_geocode(*args):
+        raise sqlite3.OperationalError("database is locked")
+
+    db_client.save_geocode = save_geocode
+    pipeline = GeoCodingPipeline(db_client, api_key=None)
+    pipeline._semaphore = asyncio.Semaphore(pipeline.concurrency)
+    pipeline.locator = FakeLocator()
+
+    items = [{"id": name, "address": "Bonner Str. 417, Köln"} for name in "ab"]
+    await asyncio.gather(*(pipeline.process_item(item) for item in items))
+
+    assert [item["latitude"] for item in items] == [50.9, 50.9]
+
+
+def test_fix_adresses():
+    pipeline = GeoCodingPipeline(db_client=None, api_key=None)
+
+    assert (
+        pipeline.fix_adresses("Berg. Gladbacher Str. 12, 42489 Wuelfrath")
+        == "bergisch gladbacher straße 12, 42489 velbert"
+    )
+    assert pipeline.fix_adresses("Saaner Str. 5, Königswinter-Thomasberg") == (
+        "saarner straße 5, königswinter"
+    )